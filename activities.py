@@ -1,17 +1,33 @@
+import aiofiles
 import aiohttp
+import asyncio
+import copy
+import hashlib
+import json
+import multiprocessing as mp
 import os
 import uuid
 import tempfile
-from typing import List, Dict
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, Optional
 from urllib.parse import urlparse
 
-from unstructured.partition.auto import partition
+import numpy as np
 from pymilvus import connections, Collection, utility, DataType, CollectionSchema, FieldSchema
 from temporalio import activity
+from temporalio.exceptions import ApplicationError
 
+import torch
 from sentence_transformers import SentenceTransformer
+from transformers import AutoTokenizer
+from huggingface_hub import hf_hub_download
 from dotenv import load_dotenv
 
+import parsing
+from workflows import EMBED_CONCURRENCY
+
 load_dotenv()
 
 TEMP_DIR = tempfile.gettempdir()
@@ -19,8 +35,199 @@ TEMP_DIR = tempfile.gettempdir()
 # Choose a HF sentence embedding model via env var
 HF_EMBED_MODEL = os.getenv("HF_EMBED_MODEL", "intfloat/e5-large-v2")
 
-_sbert = SentenceTransformer(HF_EMBED_MODEL)
-EMBED_DIM = _sbert.get_sentence_embedding_dimension()
+# Intra-op threads per encode call; worker.py sets it from EMBED_CONCURRENCY before torch loads
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "1"))
+torch.set_num_threads(TORCH_THREADS)
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+# Optional ONNX Runtime backend: exported once into ORT_MODEL_DIR, then reused on every start
+ORT_MODEL_DIR = os.getenv("ORT_MODEL_DIR")
+
+def _load_ort_model(model_dir: str):
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = TORCH_THREADS
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    provider = (
+        "CUDAExecutionProvider"
+        if "CUDAExecutionProvider" in ort.get_available_providers()
+        else "CPUExecutionProvider"
+    )
+    # IO binding (optimum's CUDA default) rejects the numpy features _encode_batch feeds in
+    if os.path.isdir(model_dir) and os.listdir(model_dir):
+        return ORTModelForFeatureExtraction.from_pretrained(
+            model_dir, provider=provider, session_options=sess_options, use_io_binding=False
+        )
+    model = ORTModelForFeatureExtraction.from_pretrained(
+        HF_EMBED_MODEL,
+        export=True,
+        provider=provider,
+        session_options=sess_options,
+        use_io_binding=False,
+    )
+    model.save_pretrained(model_dir)
+    print(f"Exported '{HF_EMBED_MODEL}' to ONNX at '{model_dir}'")
+    return model
+
+def _st_config(filename: str) -> Dict:
+    # Reads one of the sentence-transformers config files shipped with the model
+    path = os.path.join(HF_EMBED_MODEL, filename)
+    if not os.path.isdir(HF_EMBED_MODEL):
+        path = hf_hub_download(HF_EMBED_MODEL, filename)
+    with open(path) as f:
+        return json.load(f)
+
+# Encoder precision: "auto" picks fp16 on CUDA, bf16 on CPUs with AVX512_BF16, else fp32
+EMBED_PRECISION = os.getenv("EMBED_PRECISION", "auto").lower()
+
+def _model_dtype() -> torch.dtype:
+    if EMBED_PRECISION != "auto":
+        return getattr(torch, EMBED_PRECISION)
+    if torch.cuda.is_available():
+        return torch.float16
+    bf16_supported = getattr(torch.cpu, "_is_avx512_bf16_supported", lambda: False)
+    return torch.bfloat16 if bf16_supported() else torch.float32
+
+if ORT_MODEL_DIR:
+    # The ORT path only needs the tokenizer and the sentence-transformers pooling/length configs;
+    # the PyTorch weights are never loaded.
+    _sbert = None
+    _ort_model = _load_ort_model(ORT_MODEL_DIR)
+    _tokenizer = AutoTokenizer.from_pretrained(HF_EMBED_MODEL, use_fast=True)
+    _pooling = _st_config("1_Pooling/config.json")
+    EMBED_DIM = _pooling["word_embedding_dimension"]
+    # ORT path re-implements the model's pooling; sentence-transformers configs use mean or CLS
+    _pool_cls = bool(_pooling.get("pooling_mode_cls_token", False))
+    MAX_SEQ_LENGTH = _st_config("sentence_bert_config.json").get("max_seq_length") or _tokenizer.model_max_length
+    print(f"Embedding model '{HF_EMBED_MODEL}' running on ONNX Runtime from '{ORT_MODEL_DIR}'")
+else:
+    _ort_model = None
+    _sbert = SentenceTransformer(HF_EMBED_MODEL)
+    EMBED_DIM = _sbert.get_sentence_embedding_dimension()
+    _MODEL_DTYPE = _model_dtype()
+    _sbert = _sbert.to(dtype=_MODEL_DTYPE)
+    print(f"Embedding model '{HF_EMBED_MODEL}' running in {_MODEL_DTYPE}")
+
+    # Some checkpoints ship without tokenizer.json and silently load the slow Python tokenizer
+    if not _sbert.tokenizer.is_fast:
+        _sbert.tokenizer = AutoTokenizer.from_pretrained(HF_EMBED_MODEL, use_fast=True)
+    _tokenizer = _sbert.tokenizer
+    MAX_SEQ_LENGTH = _sbert.max_seq_length
+
+if not _tokenizer.is_fast:
+    print(f" No fast (Rust) tokenizer available for '{HF_EMBED_MODEL}'; tokenization will be slow.")
+
+# The HF fast tokenizer re-configures its Rust backend whenever padding/truncation settings
+# change between calls, and doing that while another activity thread is inside encode raises
+# "Already borrowed". Every encode path calls _tokenizer with the same settings
+# (padding=True, truncation=True, max_length=max_seq_length); length probing, which wants no
+# padding, gets its own copy.
+_length_tokenizer = copy.deepcopy(_tokenizer)
+
+# Warm both tokenizers at worker start, with the settings they are always called with, so the
+# first real batch doesn't pay for it
+_tokenizer(
+    ["passage: x"] * EMBED_BATCH_SIZE,
+    padding=True,
+    truncation=True,
+    max_length=MAX_SEQ_LENGTH,
+    return_tensors="pt",
+)
+
+def _token_lengths(texts: List[str]) -> List[int]:
+    return _length_tokenizer(
+        texts,
+        add_special_tokens=False,
+        truncation=True,
+        max_length=MAX_SEQ_LENGTH,
+        return_length=True,
+    )["length"]
+
+_token_lengths(["passage: x"] * EMBED_BATCH_SIZE)
+
+# Optional torch.compile path with pinned shapes: every batch is padded to EMBED_BATCH_SIZE rows
+# and to the next sequence-length bucket, so the compiled graph only ever sees a handful of
+# static shapes. Buckets rather than a single max_seq_length keep the sort-by-length savings.
+EMBED_COMPILE = os.getenv("EMBED_COMPILE", "0") == "1" and _ort_model is None
+_SEQ_BUCKETS = sorted({b for b in (64, 128, 256) if b < MAX_SEQ_LENGTH} | {MAX_SEQ_LENGTH})
+
+def _encode_pinned(texts: List[str], seq_len: Optional[int] = None) -> np.ndarray:
+    n = len(texts)
+    # Fill a short final batch by repeating the last text; the extra rows are dropped below
+    features = _tokenizer(
+        texts + [texts[-1]] * (EMBED_BATCH_SIZE - n),
+        padding=True,
+        truncation=True,
+        max_length=MAX_SEQ_LENGTH,
+        return_tensors="pt",
+    )
+    longest = features["input_ids"].shape[1]
+    pad = (seq_len or next(b for b in _SEQ_BUCKETS if b >= longest)) - longest
+    for key, value in features.items():
+        fill = _tokenizer.pad_token_id if key == "input_ids" else 0
+        features[key] = torch.nn.functional.pad(value, (0, pad), value=fill).to(_sbert.device)
+    vectors = _sbert(dict(features))["sentence_embedding"][:n]
+    vectors = torch.nn.functional.normalize(vectors, p=2, dim=1)
+    return vectors.float().cpu().numpy()
+
+if EMBED_COMPILE:
+    # No CUDA graphs: they are captured per thread and share static output buffers, but encodes
+    # run concurrently on the activity threads, not the import thread that warms them up
+    _sbert[0].auto_model = torch.compile(
+        _sbert[0].auto_model, mode="max-autotune-no-cudagraphs", dynamic=False
+    )
+    # One pass per bucket so compilation happens before the first task
+    with torch.inference_mode():
+        for bucket in _SEQ_BUCKETS:
+            _encode_pinned(["passage: x"], seq_len=bucket)
+    print(f"Compiled encoder warmed up for batch={EMBED_BATCH_SIZE}, seq buckets={_SEQ_BUCKETS}")
+
+def _encode_batch(texts: List[str]) -> np.ndarray:
+    if EMBED_COMPILE:
+        return _encode_pinned(texts)
+    if _ort_model is None:
+        vectors = _sbert.encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_tensor=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        # bf16/fp16 tensors have no direct numpy view; upcast once on the way out
+        return vectors.float().cpu().numpy()
+
+    features = _tokenizer(
+        texts,
+        padding=True,
+        truncation=True,
+        max_length=MAX_SEQ_LENGTH,
+        return_tensors="np",
+    )
+    hidden = _ort_model(**features).last_hidden_state.astype(np.float32, copy=False)
+    if _pool_cls:
+        pooled = hidden[:, 0]
+    else:
+        mask = features["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+# E5 models expect passages prefixed; the prefix adds the same token count to every text,
+# so it is applied per batch after length sorting rather than copied over the whole input.
+_PASSAGE_PREFIX = "passage: " if "e5" in HF_EMBED_MODEL.lower() else ""
+
+def _encode(texts: List[str], prefix: str = "") -> np.ndarray:
+    # Batch by token length so each batch pads to a similar length; encode() is called per
+    # batch because its own sort is by character count over the whole input.
+    order = np.argsort(_token_lengths(texts), kind="stable")
+    out = np.empty((len(texts), EMBED_DIM), dtype=np.float32)
+    with torch.inference_mode():
+        for lo in range(0, len(order), EMBED_BATCH_SIZE):
+            idx = order[lo : lo + EMBED_BATCH_SIZE]
+            out[idx] = _encode_batch([prefix + texts[i] for i in idx])
+    return out
 
 MILVUS_HOST = os.getenv("MILVUS_HOST", "localhost")
 MILVUS_PORT = os.getenv("MILVUS_PORT", "19530")
@@ -28,13 +235,19 @@ connections.connect("default", host=MILVUS_HOST, port=MILVUS_PORT)
 
 collection_name = "document_chunks"
 
+# Vectors are stored half precision: normalized embeddings lose nothing measurable in IP/cosine
+# and Milvus 2.4 has no INT8_VECTOR type.
+EMBED_DTYPE = np.float16
+
 if not utility.has_collection(collection_name):
     fields = [
         FieldSchema(name="chunk_id", dtype=DataType.INT64, is_primary=True, auto_id=True),
         FieldSchema(name="file_id", dtype=DataType.VARCHAR, max_length=100),
         FieldSchema(name="chunk_index", dtype=DataType.INT64),
         FieldSchema(name="chunk_text", dtype=DataType.VARCHAR, max_length=2000),
-        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=EMBED_DIM),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT16_VECTOR, dim=EMBED_DIM),
+        # 1 bit per dimension (sign) for a cheap Hamming first pass before the IP rerank
+        FieldSchema(name="embedding_bin", dtype=DataType.BINARY_VECTOR, dim=EMBED_DIM),
     ]
     schema = CollectionSchema(fields, description=f"Document chunks with {HF_EMBED_MODEL} embeddings ({EMBED_DIM}d)")
     Collection(name=collection_name, schema=schema)
@@ -45,87 +258,286 @@ else:
         if f.name == "embedding" and getattr(f.params, "dim", EMBED_DIM) != EMBED_DIM:
             print(f" Milvus collection '{collection_name}' has dim={getattr(f.params, 'dim', 'unknown')} "
                   f"but model produces {EMBED_DIM}d. Consider dropping the collection or using a new one.")
+        if f.name == "embedding" and f.dtype != DataType.FLOAT16_VECTOR:
+            print(f" Milvus collection '{collection_name}' stores '{f.dtype.name}' embeddings "
+                  f"but the pipeline writes FLOAT16_VECTOR. Consider dropping the collection or using a new one.")
+    # Every insert writes this column, and indexing/loading needs it, so there is no degraded mode
+    if not any(f.name == "embedding_bin" for f in existing.schema.fields):
+        raise RuntimeError(
+            f"Milvus collection '{collection_name}' predates the 'embedding_bin' field. "
+            "Drop the collection and re-ingest."
+        )
 collection = Collection(name=collection_name)
-if not any(getattr(idx, "field_name", None) == "embedding" for idx in collection.indexes):
-    collection.create_index(
-        field_name="embedding",
-        index_params={
-            "index_type": "AUTOINDEX",
-            "metric_type": "IP"
-        }
-    )
-    print(f" Index created on 'embedding' field for collection '{collection_name}'")
+# "stream": index + load at startup so each document is searchable as soon as it lands.
+# "bulk": skip both so inserts don't pay for index maintenance; finalize_index builds it once
+# after BulkIngestionWorkflow has loaded every document.
+INGEST_MODE = os.getenv("INGEST_MODE", "stream").lower()
+BULK_INDEX_PARAMS = {
+    "index_type": "HNSW",
+    "metric_type": "IP",
+    "params": {"M": 16, "efConstruction": 200},
+}
+
+# Milvus only loads a collection once every vector field is indexed
+BIN_INDEX_PARAMS = {
+    "index_type": "BIN_IVF_FLAT",
+    "metric_type": "HAMMING",
+    "params": {"nlist": 1024},
+}
+
+if INGEST_MODE == "bulk":
+    print(f"Bulk ingest mode: index build and load of '{collection_name}' deferred to finalize_index")
+else:
+    stream_indexes = {
+        "embedding": {"index_type": "AUTOINDEX", "metric_type": "IP"},
+        "embedding_bin": BIN_INDEX_PARAMS,
+    }
+    for field, index_params in stream_indexes.items():
+        if not any(getattr(idx, "field_name", None) == field for idx in collection.indexes):
+            collection.create_index(field_name=field, index_params=index_params)
+            print(f" Index created on '{field}' field for collection '{collection_name}'")
+
+    collection.load()
+    print(f"Collection '{collection_name}' loaded")
 
-collection.load()
-print(f"Collection '{collection_name}' loaded")
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_read=30)
+
+# One pooled HTTP session per worker process so keep-alive connections and DNS are reused
+_SESSION: Optional[aiohttp.ClientSession] = None
+_SESSION_LOCK = asyncio.Lock()
+
+async def _session() -> aiohttp.ClientSession:
+    global _SESSION
+    async with _SESSION_LOCK:
+        if _SESSION is None or _SESSION.closed:
+            _SESSION = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=64, limit_per_host=16, keepalive_timeout=75, ttl_dns_cache=300
+                ),
+                timeout=DOWNLOAD_TIMEOUT,
+            )
+        return _SESSION
+
+async def close_http_session() -> None:
+    global _SESSION
+    if _SESSION is not None:
+        await _SESSION.close()
+        _SESSION = None
+
+async def _stream_to_file(resp: aiohttp.ClientResponse, filepath: str) -> None:
+    # Keep one disk write in flight while the next chunk is read off the socket, so network
+    # and disk I/O overlap instead of alternating.
+    async with aiofiles.open(filepath, "wb") as f:
+        pending = None
+        try:
+            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                if pending is not None:
+                    await pending
+                pending = asyncio.ensure_future(f.write(chunk))
+        finally:
+            if pending is not None:
+                await pending
+
+ALLOWED_EXTS = {".docx", ".doc", ".pdf", ".xlsx", ".xls"}
+
+def _ext_from_url(u: str) -> str:
+    # "" when the URL path has no extension
+    return os.path.splitext(urlparse(u).path)[1]
 
 def _suffix_from_url(u: str) -> str:
-    path = urlparse(u).path
-    _, ext = os.path.splitext(path)
-    return ext if ext else ".bin"
+    return _ext_from_url(u) or ".bin"
 
 @activity.defn
 async def fetch_document(file_url: str, file_id: str) -> str:
+    ext = _ext_from_url(file_url).lower()
+    if ext and ext not in ALLOWED_EXTS:
+        raise ApplicationError(
+            f"Unsupported file type '{ext}'. Allowed: {sorted(ALLOWED_EXTS)}",
+            non_retryable=True,
+        )
     try:
         suffix = _suffix_from_url(file_url)
         filename = f"{file_id}_{uuid.uuid4().hex[:6]}{suffix}"
         filepath = os.path.join(TEMP_DIR, filename)
-        async with aiohttp.ClientSession() as session:
-            async with session.get(file_url) as resp:
-                if resp.status != 200:
-                    raise Exception(f"Failed to download file: {resp.status}")
-                with open(filepath, "wb") as f:
-                    f.write(await resp.read())
+        session = await _session()
+        async with session.get(file_url) as resp:
+            if resp.status != 200:
+                raise Exception(f"Failed to download file: {resp.status}")
+            await _stream_to_file(resp, filepath)
         return filepath
     except aiohttp.ClientError as e:
         raise Exception(f"Network error: {str(e)}")
     except Exception as e:
         raise Exception(f"Download failed: {str(e)}")
 
-@activity.defn
-def parse_document(filepath: str) -> List[str]:
+# Parsing is CPU-bound pure Python, so it runs in its own processes rather than the shared
+# activity threads. forkserver/spawn children only import `parsing`, never the embedding model.
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", str(max(1, (os.cpu_count() or 2) // 2))))
+_PARSE_POOL: Optional[ProcessPoolExecutor] = None
+
+def _parse_pool() -> ProcessPoolExecutor:
+    global _PARSE_POOL
+    if _PARSE_POOL is None:
+        method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        _PARSE_POOL = ProcessPoolExecutor(max_workers=PARSE_PROCESSES, mp_context=mp.get_context(method))
+    return _PARSE_POOL
+
+def shutdown_parse_pool() -> None:
+    global _PARSE_POOL
+    if _PARSE_POOL is not None:
+        _PARSE_POOL.shutdown(cancel_futures=True)
+        _PARSE_POOL = None
+
+@activity.defn(name="parse_document")
+async def parse_document(filepath: str) -> List[str]:
     try:
-        elements = partition(filename=filepath)
-        return [el.text.strip() for el in elements if getattr(el, "text", None) and el.text.strip()]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_parse_pool(), parsing.partition_texts, filepath)
     except Exception as e:
         raise Exception(f"Parsing failed: {str(e)}")
 
-@activity.defn
-def generate_embeddings(chunks: List[str]) -> List[List[float]]:
+# Boilerplate chunks (cover pages, footers, TOCs) repeat across documents; remember their vectors
+# by content hash so the encoder only sees new text. Per worker process, LRU-bounded.
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "50000"))
+_EMB_CACHE: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+_EMB_CACHE_LOCK = threading.Lock()
+
+# TORCH_THREADS is sized for EMBED_CONCURRENCY encodes; cap them per worker, since sibling
+# workflows (e.g. under BulkIngestionWorkflow) each schedule their own window of activities
+_ENCODE_SLOTS = threading.BoundedSemaphore(EMBED_CONCURRENCY)
+
+def _chunk_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
 
+@activity.defn
+def generate_embeddings(chunks: List[str]) -> bytes:
+    """Returns the (len(chunks), EMBED_DIM) float16 matrix as raw row-major bytes."""
     if not chunks:
-        return []
+        return b""
     try:
-        to_encode = (
-            [f"passage: {c}" for c in chunks]
-            if "e5" in HF_EMBED_MODEL.lower()
-            else chunks
-        )
-        vectors = _sbert.encode(
-            to_encode,
-            batch_size=int(os.getenv("EMBED_BATCH_SIZE", "64")),
-            convert_to_numpy=True,
-            normalize_embeddings=True,
-            show_progress_bar=False,
-        )
-        return vectors.tolist()
+        out = np.empty((len(chunks), EMBED_DIM), dtype=EMBED_DTYPE)
+        misses: Dict[bytes, List[int]] = {}
+        with _EMB_CACHE_LOCK:
+            for i, key in enumerate(_chunk_key(c) for c in chunks):
+                row = _EMB_CACHE.get(key)
+                if row is None:
+                    misses.setdefault(key, []).append(i)
+                else:
+                    _EMB_CACHE.move_to_end(key)
+                    out[i] = row
+
+        if misses:
+            # Each distinct text is encoded once, even when it repeats within this batch
+            with _ENCODE_SLOTS:
+                vectors = _encode([chunks[rows[0]] for rows in misses.values()], prefix=_PASSAGE_PREFIX)
+            with _EMB_CACHE_LOCK:
+                for (key, rows), vec in zip(misses.items(), vectors.astype(EMBED_DTYPE)):
+                    out[rows] = vec
+                    if EMBED_CACHE_SIZE > 0:
+                        _EMB_CACHE[key] = vec.copy()  # don't pin the whole batch array
+                while len(_EMB_CACHE) > EMBED_CACHE_SIZE:
+                    _EMB_CACHE.popitem(last=False)
+        return out.tobytes()
     except Exception as e:
         print(f" Error while generating embeddings: {str(e)}")
-        return []
+        return b""
+
+def _vectors_from_buffer(buf: bytes, n: int) -> np.ndarray:
+    # Whole-buffer checks: a bad payload is a logic error, so fail without retrying
+    row_nbytes = EMBED_DIM * np.dtype(EMBED_DTYPE).itemsize
+    if len(buf) != n * row_nbytes:
+        raise ApplicationError(
+            f"Embedding buffer holds {len(buf) / row_nbytes:g} rows of {EMBED_DIM}d, expected {n}",
+            non_retryable=True,
+        )
+    vecs = np.frombuffer(buf, dtype=EMBED_DTYPE).reshape(n, EMBED_DIM)
+    if not np.isfinite(vecs).all():
+        raise ApplicationError("Embedding buffer contains non-finite values", non_retryable=True)
+    return vecs
+
+# Inserts wait on the network, not the CPU: give them their own small pool so in-flight RPCs
+# don't occupy the activity threads the encoder runs on. They all share the one gRPC channel
+# behind the "default" connection.
+_MILVUS_IO = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MILVUS_IO_THREADS", "4")), thread_name_prefix="milvus"
+)
+
+def shutdown_milvus_io() -> None:
+    _MILVUS_IO.shutdown(wait=True)
+
+# Rows per Milvus insert RPC within one store_in_milvus call
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "512"))
 
 @activity.defn
-def store_in_milvus(rows: List[Dict]) -> Dict:
+async def store_in_milvus(file_id: str, start_index: int, texts: List[str], embeddings: bytes) -> Dict:
+    """Inserts one contiguous run of chunks, passed column-wise: texts[i] is chunk start_index + i."""
+    n = len(texts)
+    if not n:
+        return {"inserted": 0, "collection": collection_name, "dim": EMBED_DIM}
+    vecs = _vectors_from_buffer(embeddings, n)
     try:
-        if not rows:
-            return {"inserted": 0, "collection": collection_name, "dim": EMBED_DIM}
+        # Sign bits packed 8 dims per byte, one bytes object per row as pymilvus expects
+        bits = [row.tobytes() for row in np.packbits(vecs > 0, axis=1)]
+
+        loop = asyncio.get_running_loop()
+        for lo in range(0, n, UPSERT_BATCH_SIZE):
+            hi = min(lo + UPSERT_BATCH_SIZE, n)
+            data = [
+                [file_id] * (hi - lo),
+                list(range(start_index + lo, start_index + hi)),
+                texts[lo:hi],
+                vecs[lo:hi],
+                bits[lo:hi],
+            ]
+            mr = await loop.run_in_executor(_MILVUS_IO, collection.insert, data)
+        return {"inserted": n, "collection": collection_name, "dim": EMBED_DIM}
+    except Exception as e:
+        raise Exception(f"Milvus insert error: {str(e)}")
+
+@activity.defn
+def make_result(file_id: str, num_chunks: int, stored: int, sample_texts: List[str], embeddings: bytes) -> Dict:
+    """Builds the workflow's summary; embeddings holds (at least) the rows for sample_texts."""
+    vecs = np.frombuffer(embeddings, dtype=EMBED_DTYPE).reshape(-1, EMBED_DIM)
+    sample = [
+        {
+            "chunk_index": i,
+            "chunk_text": (txt[:200] + ("…" if len(txt) > 200 else "")),
+            "embedding_preview": vecs[i, :3].astype(float).tolist(),
+        }
+        for i, txt in enumerate(sample_texts)
+    ]
+    return {"file_id": file_id, "num_chunks": num_chunks, "stored": stored, "sample": sample}
 
-        file_ids = [r["file_id"] for r in rows]
-        idxs = [int(r["chunk_index"]) for r in rows]
-        texts = [r["chunk_text"] for r in rows]
-        vecs = [r["embedding"] for r in rows]
+@activity.defn
+def finalize_flush() -> Dict:
+    """Seals the growing segments once per document instead of after every insert batch."""
+    try:
+        collection.flush()
+        return {"collection": collection_name, "num_entities": collection.num_entities}
+    except Exception as e:
+        raise Exception(f"Milvus flush error: {str(e)}")
 
-        mr = collection.insert([file_ids, idxs, texts, vecs])
+@activity.defn
+def finalize_index() -> Dict:
+    """Builds the HNSW index once after a bulk load, then loads the collection for search."""
+    try:
         collection.flush()
-        return {"inserted": len(rows), "collection": collection_name, "dim": EMBED_DIM}
+        existing = next((idx for idx in collection.indexes if idx.field_name == "embedding"), None)
+        if existing is not None and existing.params.get("index_type") != BULK_INDEX_PARAMS["index_type"]:
+            collection.release()
+            collection.drop_index(index_name=existing.index_name)
+            existing = None
+        # create_index blocks until that field's index is built, so no separate wait is needed
+        if existing is None:
+            collection.create_index(field_name="embedding", index_params=BULK_INDEX_PARAMS)
+        if not any(idx.field_name == "embedding_bin" for idx in collection.indexes):
+            collection.create_index(field_name="embedding_bin", index_params=BIN_INDEX_PARAMS)
+        collection.load()
+        return {
+            "collection": collection_name,
+            "index_type": BULK_INDEX_PARAMS["index_type"],
+            "num_entities": collection.num_entities,
+        }
     except Exception as e:
-        raise Exception(f"Milvus insert error: {str(e)}")
+        raise Exception(f"Milvus index build error: {str(e)}")
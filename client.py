@@ -3,15 +3,21 @@ import asyncio
 import uuid
 import json
 from temporalio.client import Client
-from workflows import DocumentIngestionWorkflow
+from workflows import BulkIngestionWorkflow, DocumentIngestionWorkflow
 
 async def main():
     if len(sys.argv) != 3:
         print("Usage: python client.py <file_id> <file_url>")
+        print("       python client.py --bulk <manifest.json>   (JSON list of [file_id, file_url])")
         sys.exit(1)
 
-    file_id = sys.argv[1]
-    file_url = sys.argv[2]
+    bulk = sys.argv[1] == "--bulk"
+    if bulk:
+        with open(sys.argv[2]) as f:
+            files = json.load(f)
+    else:
+        file_id = sys.argv[1]
+        file_url = sys.argv[2]
 
     for i in range(5):
         try:
@@ -23,14 +29,22 @@ async def main():
     else:
         raise RuntimeError("Failed to connect to Temporal after retries")
 
-    workflow_id = f"workflow-{file_id}-{uuid.uuid4().hex[:6]}"
-
-    handle = await client.start_workflow(
-        workflow=DocumentIngestionWorkflow.run,
-        args=[file_id, file_url],
-        id=workflow_id,
-        task_queue="doc-ingest-queue",
-    )
+    if bulk:
+        handle = await client.start_workflow(
+            workflow=BulkIngestionWorkflow.run,
+            args=[files],
+            id=f"bulk-{uuid.uuid4().hex[:6]}",
+            task_queue="doc-ingest-queue",
+        )
+    else:
+        workflow_id = f"workflow-{file_id}-{uuid.uuid4().hex[:6]}"
+
+        handle = await client.start_workflow(
+            workflow=DocumentIngestionWorkflow.run,
+            args=[file_id, file_url],
+            id=workflow_id,
+            task_queue="doc-ingest-queue",
+        )
 
     result = await handle.result()
     print("Workflow result:")
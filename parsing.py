@@ -0,0 +1,11 @@
+from typing import List
+
+from unstructured.partition.auto import partition
+
+# Kept free of model/Milvus imports: this module is what parse worker processes import,
+# so it must stay cheap to load in each child.
+
+def partition_texts(filepath: str) -> List[str]:
+    elements = partition(filename=filepath)
+    stripped = (el.text.strip() for el in elements if getattr(el, "text", None))
+    return [text for text in stripped if text]
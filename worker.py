@@ -1,28 +1,51 @@
 import asyncio
+import os
 from concurrent.futures import ThreadPoolExecutor
+
 from temporalio.worker import Worker
 from temporalio.client import Client
 
-from workflows import DocumentIngestionWorkflow
-import activities
+from workflows import EMBED_CONCURRENCY, BulkIngestionWorkflow, DocumentIngestionWorkflow
+
+# At most EMBED_CONCURRENCY encodes run at once per worker (activities gates them), each with
+# its own OMP/MKL team of cpu_count // EMBED_CONCURRENCY threads: together they use every core
+# without oversubscribing. Must be set before torch is imported (via activities).
+os.environ.setdefault("TORCH_THREADS", str(max(1, (os.cpu_count() or 1) // EMBED_CONCURRENCY)))
+os.environ.setdefault("OMP_NUM_THREADS", os.environ["TORCH_THREADS"])
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
 
 async def main():
+    # Imported here, not at module level: parse worker processes re-import this file as
+    # their __main__ and must not load the embedding model or connect to Milvus.
+    import activities
+
     client = await Client.connect("localhost:7233")
 
-    activity_executor = ThreadPoolExecutor()
+    activity_executor = ThreadPoolExecutor(
+        max_workers=int(os.getenv("WORKER_THREADS", str(max(2, (os.cpu_count() or 4) // 2)))),
+        thread_name_prefix="act",
+    )
     worker = Worker(
         client,
         task_queue="doc-ingest-queue",
-        workflows=[DocumentIngestionWorkflow],
+        workflows=[DocumentIngestionWorkflow, BulkIngestionWorkflow],
         activities=[
             activities.fetch_document,
             activities.parse_document,
             activities.generate_embeddings,
             activities.store_in_milvus,
+            activities.make_result,
+            activities.finalize_flush,
+            activities.finalize_index,
         ],
         activity_executor=activity_executor,
     )
-    await worker.run()
+    try:
+        await worker.run()
+    finally:
+        await activities.close_http_session()
+        activities.shutdown_parse_pool()
+        activities.shutdown_milvus_io()
 
 if __name__ == "__main__":
     asyncio.run(main())
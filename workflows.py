@@ -1,40 +1,23 @@
 from temporalio import workflow
 from temporalio.common import RetryPolicy
-from temporalio.exceptions import ApplicationError
 from datetime import timedelta
+from typing import List
 import asyncio
 import os
-from urllib.parse import urlparse
 
-ALLOWED_EXTS = {".docx", ".doc", ".pdf", ".xlsx", ".xls"}
-EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
-UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "128"))
-EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))
-UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", "8"))
-
-def _ext_from_url(url: str) -> str:
-    path = urlparse(url).path
-    dot = path.rfind(".")
-    return path[dot:].lower() if dot != -1 else ""
-
-def _chunk(items, size):
-    for i in range(0, len(items), size):
-        yield items[i : i + size]
-
-def _preview_vec(vec, k=3):
-    return list(vec[:k]) if vec else []
+# Chunks per generate_embeddings activity; the encoder batches internally by EMBED_BATCH_SIZE.
+# 512 fp16 1024d vectors is a 1 MiB result, well inside Temporal's payload limit.
+EMBED_ACTIVITY_CHUNKS = int(os.getenv("EMBED_ACTIVITY_CHUNKS", "512"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "2"))
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))
+SAMPLE_ROWS = 2
 
+# URL validation, insert batching and result shaping all live in activities: the workflow body is
+# re-executed on every replay, so it only sequences activity calls.
 @workflow.defn
 class DocumentIngestionWorkflow:
     @workflow.run
     async def run(self, file_id: str, file_url: str) -> dict:
-        ext = _ext_from_url(file_url)
-        if ext and ext not in ALLOWED_EXTS:
-            raise ApplicationError(
-                f"Unsupported file type '{ext}'. Allowed: {sorted(ALLOWED_EXTS)}",
-                non_retryable=True,
-            )
-
         retry_policy = RetryPolicy(
             initial_interval=timedelta(seconds=5),
             backoff_coefficient=2.0,
@@ -58,62 +41,84 @@ class DocumentIngestionWorkflow:
         if not chunks:
             return {"file_id": file_id, "num_chunks": 0, "stored": 0, "sample": []}
 
-        records = [
-            {"file_id": file_id, "chunk_index": i, "chunk_text": txt}
-            for i, txt in enumerate(chunks)
-        ]
+        # Only the preview rows' vectors outlive their batch; everything else is dropped as soon as
+        # it has been stored so large documents don't pin their embeddings in the workflow cache.
+        sample_embeddings = []
 
-        embed_batches = list(_chunk(records, EMBED_BATCH_SIZE))
-        embed_results_all = []
-        for i in range(0, len(embed_batches), EMBED_CONCURRENCY):
-            window = embed_batches[i : i + EMBED_CONCURRENCY]
-            handles = [
-                workflow.start_activity(
-                    "generate_embeddings",
-                    args=[[r["chunk_text"] for r in batch]],
-                    schedule_to_close_timeout=timedelta(seconds=180),
-                    retry_policy=retry_policy,
-                )
-                for batch in window
-            ]
-            batch_vectors_lists = await asyncio.gather(*handles)
-            embed_results_all.extend(batch_vectors_lists)
+        async def embed_and_store(lo: int) -> int:
+            texts = chunks[lo : lo + EMBED_ACTIVITY_CHUNKS]
+            embeddings = await workflow.execute_activity(
+                "generate_embeddings",
+                args=[texts],
+                schedule_to_close_timeout=timedelta(seconds=600),
+                retry_policy=retry_policy,
+            )
+            stored = await workflow.execute_activity(
+                "store_in_milvus",
+                args=[file_id, lo, texts, embeddings],
+                schedule_to_close_timeout=timedelta(seconds=180),
+                retry_policy=retry_policy,
+            )
+            if lo == 0:
+                sample_embeddings.append(embeddings[: SAMPLE_ROWS * (len(embeddings) // len(texts))])
+            return stored["inserted"]
 
-        out_records = []
-        for batch, vectors in zip(embed_batches, embed_results_all):
-            if len(vectors) != len(batch):
-                raise ApplicationError("Embedding size mismatch within a batch", non_retryable=True)
-            for rec, vec in zip(batch, vectors):
-                out_records.append({**rec, "embedding": vec})
+        starts = range(0, len(chunks), EMBED_ACTIVITY_CHUNKS)
+        stored_total = 0
+        for i in range(0, len(starts), EMBED_CONCURRENCY):
+            window = starts[i : i + EMBED_CONCURRENCY]
+            stored_total += sum(await asyncio.gather(*(embed_and_store(lo) for lo in window)))
 
-        sample = [
-            {
-                "chunk_index": r["chunk_index"],
-                "chunk_text": (r["chunk_text"][:200] + ("…" if len(r["chunk_text"]) > 200 else "")),
-                "embedding_preview": _preview_vec(r["embedding"], 3),
-            }
-            for r in out_records[:2]
-        ]
+        await workflow.execute_activity(
+            "finalize_flush",
+            schedule_to_close_timeout=timedelta(seconds=180),
+            retry_policy=retry_policy,
+        )
 
-        upsert_batches = list(_chunk(out_records, UPSERT_BATCH_SIZE))
-        stored_total = 0
-        for i in range(0, len(upsert_batches), UPSERT_CONCURRENCY):
-            window = upsert_batches[i : i + UPSERT_CONCURRENCY]
+        return await workflow.execute_local_activity(
+            "make_result",
+            args=[file_id, len(chunks), stored_total, chunks[:SAMPLE_ROWS], sample_embeddings[0]],
+            start_to_close_timeout=timedelta(seconds=10),
+        )
+
+@workflow.defn
+class BulkIngestionWorkflow:
+    """Ingests many documents as child workflows, then builds the vector index once.
+
+    Meant for workers started with INGEST_MODE=bulk, which skip index creation at startup.
+    """
+
+    @workflow.run
+    async def run(self, files: List[List[str]]) -> dict:
+        results = []
+        for i in range(0, len(files), BULK_CONCURRENCY):
+            window = files[i : i + BULK_CONCURRENCY]
             handles = [
-                workflow.start_activity(
-                    "store_in_milvus",
-                    args=[batch],
-                    schedule_to_close_timeout=timedelta(seconds=180),
-                    retry_policy=retry_policy,
+                workflow.execute_child_workflow(
+                    DocumentIngestionWorkflow.run,
+                    args=[file_id, file_url],
+                    id=f"{workflow.info().workflow_id}-{i + j}-{file_id}",
                 )
-                for batch in window
+                for j, (file_id, file_url) in enumerate(window)
             ]
-            results = await asyncio.gather(*handles)
-            stored_total += sum(r.get("inserted", 0) for r in results)
+            results.extend(await asyncio.gather(*handles, return_exceptions=True))
+
+        failed = [
+            {"file_id": file_id, "error": str(res)}
+            for (file_id, _), res in zip(files, results)
+            if isinstance(res, BaseException)
+        ]
+        stored = sum(res.get("stored", 0) for res in results if not isinstance(res, BaseException))
+
+        index = await workflow.execute_activity(
+            "finalize_index",
+            schedule_to_close_timeout=timedelta(hours=2),
+            retry_policy=RetryPolicy(maximum_attempts=3),
+        )
 
         return {
-            "file_id": file_id,
-            "num_chunks": len(records),
-            "stored": stored_total,
-            "sample": sample,
+            "documents": len(files),
+            "stored": stored,
+            "failed": failed,
+            "index": index,
         }